@@ -1,20 +1,98 @@
+import asyncio
+from contextlib import asynccontextmanager
 import clickhouse_connect
-from clickhouse_connect.driver import Client
-import pandas as pd
+from clickhouse_connect.driver import Client, httputil
 import logging
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, AsyncIterator, Optional, Sequence
 from core.config import settings
 
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow is optional; fetches fall back to native column blocks
+    pa = None
+
+try:
+    import asynch
+except ImportError:  # asynch is optional; fetches stay on the HTTP interface
+    asynch = None
+
 logger = logging.getLogger(__name__)
 
+# Keyset page queries: the first page of an integration, and the page after a known id
+_Q_FIRST = """
+SELECT id, raw_data
+FROM queryinside.logs
+WHERE integration_id = {integration_id:String}
+ORDER BY id ASC
+LIMIT {page_size:UInt32}
+"""
+
+_Q_PAGE = """
+SELECT id, raw_data
+FROM queryinside.logs
+WHERE integration_id = {integration_id:String}
+AND id > {last_id:String}
+ORDER BY id ASC
+LIMIT {page_size:UInt32}
+"""
+
+# The same queries in the native protocol's parameter syntax
+_NATIVE_Q_FIRST = """
+SELECT id, raw_data
+FROM queryinside.logs
+WHERE integration_id = %(integration_id)s
+ORDER BY id ASC
+LIMIT %(page_size)s
+"""
+
+_NATIVE_Q_PAGE = """
+SELECT id, raw_data
+FROM queryinside.logs
+WHERE integration_id = %(integration_id)s
+AND id > %(last_id)s
+ORDER BY id ASC
+LIMIT %(page_size)s
+"""
+
+
+def last_value(column: Sequence) -> Any:
+    """Return the last value of a fetched column as a plain Python value"""
+    if not len(column):
+        return None
+    value = column[-1]
+    # Arrow columns hold scalars rather than Python values
+    return value.as_py() if hasattr(value, "as_py") else value
+
+
 class ClickHouseClient:
     """ClickHouse Cloud client for log data operations"""
     
     def __init__(self):
-        self.client: Optional[Client] = None
+        # Each client session only runs one query at a time, so concurrent
+        # fetches borrow an idle client from the pool and return it afterwards
+        self.clients: List[Client] = []
+        self._idle_clients: Optional[asyncio.Queue] = None
+        # Only one caller builds the pool; the others wait and reuse it
+        self._connect_lock = asyncio.Lock()
+        # One long-lived HTTP pool shared by every client, so reconnects reuse
+        # kept-alive TLS connections instead of resolving and handshaking again
+        self._pool_mgr = httputil.get_pool_manager(
+            num_pools=1,
+            maxsize=settings.clickhouse_pool_size,
+            block=True,
+            verify=settings.clickhouse_verify_ssl,
+            ca_cert=settings.clickhouse_ca_cert or None,
+        )
+        # asynch pool for the native TCP protocol, used for bulk fetches when enabled
+        self.native_pool = None
     
     async def connect(self):
         """Initialize connection to ClickHouse Cloud"""
+        async with self._connect_lock:
+            await self._connect()
+
+    async def _connect(self):
+        """Build the client pool; the caller holds _connect_lock"""
         try:
             # Prepare connection settings for ClickHouse Cloud
             connection_settings = {
@@ -26,6 +104,9 @@ class ClickHouseClient:
                 'secure': settings.clickhouse_secure,
                 'connect_timeout': settings.clickhouse_connect_timeout,
                 'send_receive_timeout': settings.clickhouse_send_receive_timeout,
+                # Compress result blocks on the wire; an empty setting disables it
+                'compress': settings.clickhouse_compression or False,
+                'pool_mgr': self._pool_mgr,
             }
             
             # Add SSL settings for ClickHouse Cloud
@@ -41,7 +122,7 @@ class ClickHouseClient:
             # Try different connection approaches for ClickHouse Cloud
             try:
                 # Method 1: Standard connection
-                self.client = clickhouse_connect.get_client(**connection_settings)
+                client = await asyncio.to_thread(clickhouse_connect.get_client, **connection_settings)
             except Exception as e:
                 logger.warning(f"Standard connection failed: {e}")
                 
@@ -49,14 +130,34 @@ class ClickHouseClient:
                 if settings.clickhouse_port == 8443:
                     logger.info("Trying connection with port 9440...")
                     connection_settings['port'] = 9440
-                    self.client = clickhouse_connect.get_client(**connection_settings)
+                    client = await asyncio.to_thread(clickhouse_connect.get_client, **connection_settings)
                 else:
                     raise e
             
             # Test connection
-            test_result = self.client.query('SELECT version()')
+            test_result = await asyncio.to_thread(client.query, 'SELECT version()')
             logger.info(f"Connected to ClickHouse Cloud successfully. Version: {test_result.result_rows[0][0]}")
             logger.info(f"Connected to: {settings.clickhouse_host}:{connection_settings.get('port', settings.clickhouse_port)}")
+
+            # Fill the rest of the pool concurrently using the settings that worked
+            clients = [client]
+            clients += await asyncio.gather(*(
+                asyncio.to_thread(clickhouse_connect.get_client, **connection_settings)
+                for _ in range(settings.clickhouse_pool_size - 1)
+            ))
+
+            self.clients = clients
+            self._idle_clients = asyncio.Queue()
+            for client in clients:
+                self._idle_clients.put_nowait(client)
+            logger.info(f"ClickHouse client pool ready with {len(clients)} clients")
+
+            # Route bulk fetches over the native TCP protocol when requested
+            if settings.clickhouse_native:
+                if asynch is None:
+                    logger.warning("CLICKHOUSE_NATIVE is set but asynch is not installed; fetching over HTTP")
+                else:
+                    await self._connect_native()
             
         except Exception as e:
             logger.error(f"Failed to connect to ClickHouse Cloud: {e}")
@@ -67,52 +168,162 @@ class ClickHouseClient:
             logger.error("4. Check if your IP is whitelisted in ClickHouse Cloud")
             raise
     
+    async def _connect_native(self):
+        """Open the native TCP pool used for bulk log fetches"""
+        try:
+            native_pool = asynch.Pool(
+                minsize=1,
+                maxsize=settings.clickhouse_pool_size,
+                host=settings.clickhouse_host,
+                port=settings.clickhouse_native_port,
+                database=settings.clickhouse_database,
+                user=settings.clickhouse_username,
+                password=settings.clickhouse_password,
+                secure=settings.clickhouse_secure,
+                verify=settings.clickhouse_verify_ssl,
+                ca_certs=settings.clickhouse_ca_cert or None,
+                compression=settings.clickhouse_compression or False,
+            )
+            await native_pool.startup()
+            self.native_pool = native_pool
+            logger.info(f"Native ClickHouse pool ready on port {settings.clickhouse_native_port}")
+        except Exception as e:
+            self.native_pool = None
+            logger.warning(f"Native ClickHouse connection failed, fetching over HTTP: {e}")
+
     async def disconnect(self):
         """Close connection"""
         try:
-            if self.client:
-                self.client.close()
+            for client in self.clients:
+                client.close()
+            self.clients = []
+            self._idle_clients = None
+            self._pool_mgr.clear()
+
+            if self.native_pool is not None:
+                await self.native_pool.shutdown()
+                self.native_pool = None
             logger.info("Disconnected from ClickHouse Cloud")
         except Exception as e:
             logger.error(f"Error disconnecting from ClickHouse Cloud: {e}")
     
-    async def fetch_log_data_by_integration_id(self, integration_id: str, last_id: str = None) -> list:
+    async def _ensure_connected(self):
+        """Connect lazily if startup did not"""
+        if self._idle_clients is not None:
+            return
+        async with self._connect_lock:
+            if self._idle_clients is None:
+                logger.info("ClickHouse client not connected. Connecting now...")
+                await self._connect()
+
+    async def _acquire(self) -> Client:
+        """Wait for an idle client, connecting the pool first if needed"""
+        await self._ensure_connected()
+        return await self._idle_clients.get()
+
+    @asynccontextmanager
+    async def client(self) -> AsyncIterator[Client]:
+        """Borrow a client from the pool for the duration of the block"""
+        client = await self._acquire()
+        # Return it to the pool it came from, even if the pool reconnects meanwhile
+        idle_clients = self._idle_clients
+        try:
+            yield client
+        finally:
+            idle_clients.put_nowait(client)
+
+    @staticmethod
+    def _fetch_page(client: Client, query: str, params: dict) -> Dict[str, Sequence]:
+        """Run a single page query (blocking) and return its columns"""
+        if pa is not None:
+            # Read the page as a single columnar Arrow table
+            table = client.query_arrow(query, parameters=params, use_strings=True)
+            if not table.num_rows:
+                return {}
+            return {name: table.column(name) for name in table.column_names}
+
+        # Without pyarrow, collect the native column blocks as-is
+        columns = {"id": [], "raw_data": []}
+        with client.query_column_block_stream(query, parameters=params) as stream:
+            for ids, raw_data in stream:
+                columns["id"].extend(ids)
+                columns["raw_data"].extend(raw_data)
+        return columns
+
+    async def _fetch_native_page(self, integration_id: str, last_id: Optional[str]) -> Dict[str, Sequence]:
+        """Fetch the page of rows following last_id over the native TCP protocol"""
+        params = {"integration_id": integration_id, "page_size": settings.clickhouse_page_size}
+        if last_id:
+            params["last_id"] = last_id
+        query = _NATIVE_Q_PAGE if last_id else _NATIVE_Q_FIRST
+
+        # The native protocol parser hands back row tuples directly
+        async with self.native_pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(query, params)
+                rows = await cursor.fetchall()
+
+        # Transpose into columns in one pass; an empty page yields no columns
+        return dict(zip(("id", "raw_data"), zip(*rows)))
+
+    async def _fetch_page_after(self, integration_id: str, last_id: Optional[str]) -> Dict[str, Sequence]:
+        """Fetch the page of rows following last_id without blocking the event loop"""
+        await self._ensure_connected()
+        if self.native_pool is not None:
+            return await self._fetch_native_page(integration_id, last_id)
+
+        params = {"integration_id": integration_id, "page_size": settings.clickhouse_page_size}
+        if last_id:
+            params["last_id"] = last_id
+        query = _Q_PAGE if last_id else _Q_FIRST
+
+        async with self.client() as client:
+            query_task = asyncio.ensure_future(asyncio.to_thread(self._fetch_page, client, query, params))
+            try:
+                return await asyncio.shield(query_task)
+            except asyncio.CancelledError:
+                # Cancelling doesn't stop the worker thread, so keep the client
+                # borrowed until its query has finished
+                await asyncio.wait({query_task})
+                if not query_task.cancelled():
+                    query_task.exception()  # Retrieved so it isn't reported as unhandled
+                raise
+
+    async def fetch_log_data_by_integration_id(
+        self, integration_id: str, last_id: str = None
+    ) -> AsyncIterator[Dict[str, Sequence]]:
         """
-        Fetch log data from ClickHouse by integration_id.
+        Fetch log data from ClickHouse by integration_id, one page at a time.
         If last_id is provided, only fetch rows after that id.
-        Returns raw list of rows instead of DataFrame for speed.
+        Yields the columns of each page keyed by name (Arrow columns when pyarrow
+        is installed, plain lists otherwise). The next page is already being
+        fetched while the caller works on the current one.
+        A failed page query is logged and re-raised to the caller.
         """
+        next_page = None
         try:
-            if self.client is None:
-                logger.info("ClickHouse client not connected. Connecting now...")
-                await self.connect()
+            next_page = asyncio.create_task(self._fetch_page_after(integration_id, last_id))
+            while next_page is not None:
+                columns = await next_page
+                next_page = None
 
-            # Base query
-            query = """
-            SELECT id, raw_data
-            FROM queryinside.logs
-            WHERE integration_id = {integration_id:String}
-            {last_id_filter:sql}
-            ORDER BY timestamp ASC
-            LIMIT 100000
-            """
+                ids = columns.get("id", [])
+                if not len(ids):
+                    break
 
-            # Prepare filter only if last_id is provided
-            last_id_filter = ""
-            params = {"integration_id": integration_id}
+                # A full page means there may be more rows after it
+                if len(ids) == settings.clickhouse_page_size:
+                    next_page = asyncio.create_task(self._fetch_page_after(integration_id, last_value(ids)))
 
-            if last_id:
-                last_id_filter = "AND id > {last_id:String}"
-                params["last_id"] = last_id
-
-            # Inject filter safely
-            query = query.format(last_id_filter=last_id_filter)
-
-            # Fetch as list of dicts (faster & lighter than DataFrame)
-            result = self.client.query(query, params)
-            return [row for row in result.result_rows]
+                yield columns
 
         except Exception as e:
             logger.error(f"Failed to fetch log data for integration_id {integration_id}: {e}")
-            return []
+            raise
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
 
+# Create global ClickHouse client instance
+clickhouse_client = ClickHouseClient()
@@ -1,11 +1,16 @@
 import asyncio
-import json
-from typing import Callable, Optional
+import logging
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Set
 
 import aio_pika
+import orjson
+from aio_pika.exceptions import ChannelInvalidStateError
 
 from core.config import settings
 
+logger = logging.getLogger(__name__)
+
 
 class RabbitMQClient:
     def __init__(self):
@@ -14,14 +19,29 @@ class RabbitMQClient:
         self.exchange: Optional[aio_pika.Exchange] = None
         self.queue: Optional[aio_pika.Queue] = None
 
+        # In-flight message tasks, referenced here so they aren't garbage collected
+        self._message_tasks: Set[asyncio.Task] = set()
+
+        # Ack bookkeeping for the channel currently delivering messages. Delivery tags
+        # restart on every channel, so settlements from any other channel are dropped.
+        self._ack_channel = None
+        # Delivery tags in the order the broker sent them, and the ones already settled.
+        # A settled tag maps to its message when it still needs an ack, or None if nacked.
+        self._unsettled_tags: Deque[int] = deque()
+        self._settled: Dict[int, Optional[aio_pika.IncomingMessage]] = {}
+        # Flushes are serialized so their multiple=True acks go out in tag order
+        self._flush_lock = asyncio.Lock()
+
     async def connect(self):
         """Establish connection to RabbitMQ"""
         try:
             self.connection = await aio_pika.connect_robust(settings.rabbitmq_url)
-            self.channel = await self.connection.channel()
+            # Without confirms, publish returns without waiting a round-trip for the broker
+            self.channel = await self.connection.channel(publisher_confirms=settings.publisher_confirms)
+            self._reset_ack_state()
             
-            # Set QoS to process one message at a time for better resource management
-            await self.channel.set_qos(prefetch_count=1)
+            # Let the broker push a window of messages so they can be processed concurrently
+            await self.channel.set_qos(prefetch_count=settings.prefetch_count)
             
             # Declare exchange (use default exchange if name is empty)
             if settings.exchange_name:
@@ -54,24 +74,101 @@ class RabbitMQClient:
     async def disconnect(self):
         """Close RabbitMQ connection"""
         if self.connection:
+            await self.flush_acks()
             await self.connection.close()
 
+    def _reset_ack_state(self, channel=None):
+        """Start ack bookkeeping afresh for a (re)opened channel"""
+        self._ack_channel = channel
+        self._unsettled_tags.clear()
+        self._settled.clear()
+
+    def _track_delivery(self, message: aio_pika.IncomingMessage):
+        """Record a delivered message in the bookkeeping of its channel"""
+        if message.channel is not self._ack_channel:
+            self._reset_ack_state(message.channel)
+        self._unsettled_tags.append(message.delivery_tag)
+
+    def _is_tracked(self, message: aio_pika.IncomingMessage) -> bool:
+        """Whether the message came from the channel acks are being tracked for"""
+        try:
+            return message.channel is self._ack_channel
+        except ChannelInvalidStateError:
+            # Its channel has closed, so the broker redelivers it on the new one
+            return False
+
+    async def ack_message(self, message: aio_pika.IncomingMessage):
+        """Queue a processed message for a batched ack"""
+        if not self._is_tracked(message):
+            return
+        self._settled[message.delivery_tag] = message
+        if len(self._settled) >= settings.ack_batch_size:
+            await self.flush_acks()
+
+    async def nack_message(self, message: aio_pika.IncomingMessage):
+        """Reject a message immediately so it is redelivered"""
+        if not self._is_tracked(message):
+            return
+        await message.nack()
+        # Only settle once the nack is sent, or a flush could ack past it first
+        self._settled[message.delivery_tag] = None
+
+    async def flush_acks(self):
+        """
+        Ack every settled message in one frame.
+        Only the contiguous prefix of settled deliveries is acked, since
+        multiple=True also covers lower tags that may still be in flight.
+        """
+        async with self._flush_lock:
+            last_message = None
+            while self._unsettled_tags and self._unsettled_tags[0] in self._settled:
+                message = self._settled.pop(self._unsettled_tags.popleft())
+                if message is not None:
+                    last_message = message
+
+            if last_message is not None:
+                try:
+                    await last_message.ack(multiple=True)
+                except Exception as e:
+                    logger.error("Failed to ack messages: %s", e)
+
+    async def _flush_acks_periodically(self):
+        """Bound ack latency when the batch does not fill up"""
+        while True:
+            await asyncio.sleep(settings.ack_flush_interval)
+            await self.flush_acks()
+
     async def publish_message(self, topic_data: dict, priority: int = 5):
         """Publish message to queue"""
+        await self.publish_bytes(
+            orjson.dumps(topic_data),
+            priority=priority,
+            headers={
+                "content_type": "application/json",
+                "topic_id": topic_data.get("topic_id"),
+                "service": topic_data.get("service")
+            }
+        )
+
+    async def publish_bytes(
+        self,
+        body: bytes,
+        routing_key: Optional[str] = None,
+        priority: int = 5,
+        headers: Optional[dict] = None
+    ):
+        """Publish an already encoded JSON body to queue"""
         try:
             message = aio_pika.Message(
-                json.dumps(topic_data).encode(),
+                body,
                 priority=priority,
                 delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                headers={
-                    "content_type": "application/json",
-                    "topic_id": topic_data.get("topic_id"),
-                    "service": topic_data.get("service")
-                }
+                headers=headers or {"content_type": "application/json"}
             )
             
             # Use routing_key as queue name for default exchange
-            routing_key = settings.queue_name if not settings.exchange_name else settings.routing_key
+            if routing_key is None:
+                routing_key = settings.queue_name if not settings.exchange_name else settings.routing_key
             
             await self.exchange.publish(
                 message,
@@ -83,19 +180,33 @@ class RabbitMQClient:
 
     async def consume_messages(self, callback: Callable):
         """Start consuming messages from queue"""
+        flush_task = asyncio.create_task(self._flush_acks_periodically())
         try:
-            await self.queue.consume(callback)
-            print(f"🎯 Started consuming messages from queue: {settings.queue_name}")
-            
-            # Keep the consumer running
-            try:
-                await asyncio.Future()  # Run forever
-            except asyncio.CancelledError:
-                print("Consumer cancelled")
+            async with self.queue.iterator() as queue_iter:
+                print(f"🎯 Started consuming messages from queue: {settings.queue_name}")
+
+                # Dispatch each prefetched message as its own task so they run concurrently
+                try:
+                    async for message in queue_iter:
+                        self._track_delivery(message)
+                        task = asyncio.create_task(callback(message))
+                        self._message_tasks.add(task)
+                        task.add_done_callback(self._on_message_done)
+                except asyncio.CancelledError:
+                    print("Consumer cancelled")
                 
         except Exception as e:
             print(f"Failed to consume messages: {e}")
             raise
+        finally:
+            flush_task.cancel()
+            await self.flush_acks()
+
+    def _on_message_done(self, task: asyncio.Task):
+        """Forget a finished message task; a failure is reported without stopping the consumer"""
+        self._message_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Failed to process message: %s", task.exception())
 
     # Keep the old method name for backwards compatibility
     async def consume_topics(self, callback: Callable):
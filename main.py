@@ -1,26 +1,41 @@
 import asyncio
-import json
+import logging
 from datetime import datetime
 from typing import Dict
 
+import orjson
 from fastapi import FastAPI, HTTPException, status, BackgroundTasks
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
-from config.clickhouse import clickhouse_client
+from config.clickhouse import clickhouse_client, last_value
 from config.rabbitmq import rabbitmq_client
+from core.config import settings
 from model.topic import TopicRequest, TopicResponse, ConsumerStatus
 
-app = FastAPI()
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    import uvloop
+
+    uvloop.install()
+except ImportError:  # uvloop is unavailable on Windows; keep the default event loop
+    pass
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Global counters and state tracking
 message_count = 0
-processed_integrations = set()
 service_status = {
     "consumer": "stopped",
     "clickhouse": "disconnected",
     "rabbitmq": "disconnected"
 }
 
+# Caps how many messages are processed at once so ClickHouse isn't overwhelmed
+message_semaphore = asyncio.Semaphore(settings.prefetch_count)
+
 @app.get("/health", status_code=status.HTTP_200_OK)
 async def health_check():
     """Health check endpoint for the API"""
@@ -73,6 +88,14 @@ async def lifespan(app):
     print("✅ Shutdown complete")
 
 
+def _build_message(request: TopicRequest) -> bytes:
+    """Encode the message to publish from the request data"""
+    return orjson.dumps({
+        "integration_id": request.integration_id,
+        "service_type": request.service_type,
+    })
+
+
 @app.post("/publish-topic", response_model=TopicResponse)
 async def publish_topic(request: TopicRequest):
     """
@@ -80,14 +103,8 @@ async def publish_topic(request: TopicRequest):
     Consumer will process this JSON based on service_type
     """
     try:
-        # Create message to publish using request data
-        message_data = {
-            "integration_id": request.integration_id,
-            "service_type": request.service_type,
-        }
-        
-        # Publish to RabbitMQ
-        await rabbitmq_client.publish_message(message_data)
+        # Publish the pre-encoded message to RabbitMQ
+        await rabbitmq_client.publish_bytes(_build_message(request))
         
         return TopicResponse(
             message=f"Topic published successfully for integration {request.integration_id}",
@@ -109,22 +126,27 @@ async def handle_qi_service(integration_id: str):
     """
     try:
         # Fetch log data from ClickHouse
-        print(f"📊 Fetching QI data for integration: {integration_id}")
-        log_data = await clickhouse_client.fetch_log_data_by_integration_id(integration_id)
-        
-        # Process the data
+        logger.debug("📊 Fetching QI data for integration: %s", integration_id)
+        data_count = 0
+        last_id = None
+        async for columns in clickhouse_client.fetch_log_data_by_integration_id(integration_id):
+            # Process the data page by page
+            ids = columns["id"]
+            data_count += len(ids)
+            last_id = last_value(ids)
+
         result = {
             "integration_id": integration_id,
             "service": "qi",
-            "data_count": len(log_data),
-            "last_id": log_data[-1][0] if log_data else None,
+            "data_count": data_count,
+            "last_id": last_id,
             "timestamp": str(datetime.now())
         }
         
-        print(f"✅ QI service processed {len(log_data)} records for integration: {integration_id}")
+        logger.debug("✅ QI service processed %d records for integration: %s", data_count, integration_id)
         return result
     except Exception as e:
-        print(f"❌ Error in QI service for integration {integration_id}: {e}")
+        logger.error("❌ Error in QI service for integration %s: %s", integration_id, e)
         return {
             "integration_id": integration_id,
             "service": "qi",
@@ -137,73 +159,84 @@ async def process_message(message):
     Process message from RabbitMQ:
     1. Log the received message
     2. Route to appropriate service handler based on service_type
-    3. Track processed messages and integrations
+    3. Track processed messages
     """
-    global message_count, processed_integrations
+    global message_count
     
-    try:
-        # Decode and parse message
-        message_body = json.loads(message.body.decode())
-        message_count += 1
-        
-        # Print the received message
-        print("=" * 80)
-        print(f"📩 MESSAGE #{message_count} RECEIVED:")
-        print("=" * 80)
-        print(json.dumps(message_body, indent=2))
-        print("=" * 80)
-        
-        # Extract message details
-        integration_id = message_body.get("integration_id")
-        service_type = message_body.get("service_type")
-        
-        # Log the service type
-        print(f"📋 Processing message for service type: {service_type}")
-        
-        # Route to appropriate service handler
-        if service_type == "qi":
-            await handle_qi_service(integration_id)
-        else:
-            print(f"⚠️ Unsupported service type: {service_type}")
-        
-        # Track processed integration
-        if integration_id:
-            processed_integrations.add(integration_id)
-        
-        # Acknowledge message
-        await message.ack()
-        
-    except Exception as e:
-        print(f"❌ Error processing message: {e}")
-        # Reject message on error
-        await message.nack()
+    async with message_semaphore:
+        try:
+            # Empty bodies (e.g. heartbeats) carry nothing to process
+            if not message.body:
+                await rabbitmq_client.ack_message(message)
+                return
+
+            # Parse message straight from the raw bytes
+            message_body = orjson.loads(message.body)
+            message_count += 1
+
+            if not isinstance(message_body, dict):
+                logger.warning("⚠️ Skipping message that is not a JSON object: %s", type(message_body).__name__)
+                await rabbitmq_client.ack_message(message)
+                return
+            
+            # Extract message details
+            integration_id = message_body.get("integration_id")
+            service_type = message_body.get("service_type")
+            
+            # Log the received message
+            logger.debug("📩 Message #%d received for service type: %s", message_count, service_type)
+            
+            # Route to appropriate service handler
+            if service_type == "qi":
+                await handle_qi_service(integration_id)
+            else:
+                logger.warning("⚠️ Unsupported service type: %s", service_type)
+            
+            # Acknowledge message (acks are batched by the client)
+            await rabbitmq_client.ack_message(message)
+            
+        except Exception as e:
+            logger.error("❌ Error processing message: %s", e)
+            # Reject message on error
+            await rabbitmq_client.nack_message(message)
 
 async def start_consumer():
     """Start consuming messages from RabbitMQ"""
     global service_status
     
     try:
-        print("🚀 Starting RabbitMQ consumer...")
+        logger.info("🚀 Starting RabbitMQ consumer...")
         await rabbitmq_client.connect()
         service_status["rabbitmq"] = "connected"
-        print("✅ Connected to RabbitMQ")
+        logger.info("✅ Connected to RabbitMQ")
         
         service_status["consumer"] = "running"
         await rabbitmq_client.consume_messages(process_message)
     except Exception as e:
         service_status["rabbitmq"] = "error"
         service_status["consumer"] = "error"
-        print(f"❌ Failed to start consumer: {e}")
+        logger.error("❌ Failed to start consumer: %s", e)
 
 
 # End of consumer functionality
+def get_message_count() -> int:
+    """Number of messages received by the consumer so far"""
+    return message_count
+
+
+@app.get("/message-count")
+async def message_count_endpoint():
+    """Get number of processed messages"""
+    return {"message_count": get_message_count()}
+
+
 @app.get("/consumer-status", response_model=ConsumerStatus)
 async def get_consumer_status():
     """Get detailed consumer status"""
     return ConsumerStatus(
         service="Data Pipeline Consumer",
         status=service_status,
-        messages_processed=message_count
+        messages_processed=get_message_count()
     )
 
 